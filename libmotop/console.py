@@ -134,6 +134,9 @@ class Block:
     def reset(self, lines):
         self.__lines = lines
 
+    def lines(self):
+        return self.__lines
+
     def __len__(self):
         return len(self.__lines)
 
@@ -15,10 +15,15 @@
 # performance of this software.
 ##
 
+"""Library imports"""
+import os
+import sys
+
 """Class imports"""
 from libmotop.console import Console
-from libmotop.server import Server
+from libmotop.server import Server, OperationSampler
 from libmotop.queryscreen import QueryScreen
+from libmotop.recorder import FlightRecorder
 
 """Two attempts to import the same class for Python 3 compatibility."""
 try:
@@ -32,17 +37,29 @@ from libmotop import __name__, __version__, __doc__
 """Main configuration"""
 configFile = '/etc/motop.conf'
 optionalVariables = ('username', 'password')
-choices = ('status', 'replicationInfo', 'replicaSet', 'operations', 'replicationOperations')
+choices = ('status', 'wiredTiger', 'replicationInfo', 'replicaSet', 'oplog', 'top', 'operations',
+           'replicationOperations')
 
 def version():
     return __name__ + ' ' + str(__version__)
 
+def samplingFrequency(value):
+    """Validate the sampling frequency. Limit it not to busy loop on the servers."""
+    from argparse import ArgumentTypeError
+    try:
+        frequency = float(value)
+    except ValueError:
+        raise ArgumentTypeError('invalid frequency: ' + value)
+    if not frequency > 0:
+        raise ArgumentTypeError('frequency must be positive: ' + value)
+    return min(frequency, OperationSampler.maximumFrequency)
+
 def parseArguments():
     """Create ArgumentParser instance. Return parsed arguments."""
     from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter, description=__doc__)
     parser.add_argument('hosts', metavar='host', nargs='*', default=('localhost:27017',),
-            help='address of the server or section name on the configuration file')
+            help='address of the server, section name or tag with "@" prefix on the configuration file')
     parser.add_argument('-u', '--username', dest='username', help='username for authentication')
     parser.add_argument('-p', '--password', dest='password', help='password for authentication')
     parser.add_argument('-c', '--conf', dest='conf', default=configFile,
@@ -50,21 +67,66 @@ def parseArguments():
     parser.add_argument('-V', '--version', action='version', version=version())
     parser.add_argument('-K', '--auto-kill', dest='autoKillSeconds',
             help='seconds to kill operations automatically')
+    parser.add_argument('-s', '--sampling-frequency', dest='samplingFrequency', type=samplingFrequency,
+            help='times in a second like 5 to 20, at most 50, to sample operations to estimate the share of the '
+                 'query shapes')
+    parser.add_argument('-t', '--top-interval', dest='topInterval', type=float, default=5,
+            help='seconds between executions of the top command')
+    parser.add_argument('--record', dest='recordDirectory',
+            help='directory to dump the recent status and operations kept in memory when a trigger fires')
+    parser.add_argument('--record-minutes', dest='recordMinutes', type=float, default=10,
+            help='minutes to keep the status and operations in memory')
+    parser.add_argument('--record-mb', dest='recordMegabytes', type=float, default=50,
+            help='megabytes to keep the status and operations in memory')
+    parser.add_argument('--trigger-queue', dest='triggerQueue', type=int,
+            help='dump when the queue of a server is longer than given operations')
+    parser.add_argument('--trigger-qps-drop', dest='triggerQpsDrop', type=float,
+            help='dump when the queries per second of a server drops more than given percent from its average')
+    parser.add_argument('--trigger-operation', dest='triggerOperationSeconds', type=float,
+            help='dump when an operation runs more than given seconds')
+    parser.add_argument('--trigger-lag', dest='triggerLag', type=float,
+            help='dump when the lag of a replica set member is more than given seconds')
     return parser.parse_args()
 
+def configServer(config, section):
+    """Create the server with the parameters on the section of the config."""
+    parameters = dict((key, config.get(section, key)) for key in optionalVariables if config.has_option(section, key))
+    return Server(section, config.get(section, 'address'), **parameters)
+
+def taggedSections(config):
+    """Index the sections of the config by their tags."""
+    sections = {}
+    for section in config.sections():
+        if config.has_option(section, 'tags'):
+            for tag in config.get(section, 'tags').replace(',', ' ').split():
+                sections.setdefault(tag, []).append(section)
+    return sections
+
 def commonServers(config, arguments):
-    """First try to match servers on the config with the ones on the arguments."""
-    servers = []
+    """First try to match servers and tags on the config with the ones on the arguments."""
+    sections = set(config.sections())
+    tags = taggedSections(config)
+    chosenSections = []
     for host in arguments.hosts:
-        for section in config.sections():
-            if section == host:
-                servers.append(Server(section, **dict(config.items(section))))
-    if servers:
-        return servers
+        if host.startswith('@'):
+            chosenSections.extend(tags.get(host[1:], ()))
+        elif host in sections:
+            chosenSections.append(host)
+    if not chosenSections and any(host.startswith('@') for host in arguments.hosts):
+        """Do not fall back to all of the servers on the config for unknown tags."""
+        sys.exit('No servers on the configuration with the tags: ' +
+                 ' '.join(host for host in arguments.hosts if host.startswith('@')))
+    if chosenSections:
+        uniqueSections = []
+        for section in chosenSections:
+            if section in sections:
+                uniqueSections.append(section)
+                sections.remove(section)
+        return [configServer(config, section) for section in uniqueSections]
 
     """Second use the servers on the config."""
     if config.sections():
-        return [Server(section, **dict(config.items(section))) for section in config.sections()]
+        return [configServer(config, section) for section in config.sections()]
 
     """Third use the servers on the arguments."""
     return [Server(host, host, arguments.username, arguments.password) for host in arguments.hosts]
@@ -87,9 +149,22 @@ def run():
         else:
             chosenServers[choice] = servers
 
+    recorder = None
+    if arguments.recordDirectory:
+        if not os.path.isdir(arguments.recordDirectory) or not os.access(arguments.recordDirectory, os.W_OK):
+            sys.exit('Directory to record is not writable: ' + arguments.recordDirectory)
+        recorder = FlightRecorder(arguments.recordDirectory, arguments.recordMinutes, arguments.recordMegabytes,
+                                  queue=arguments.triggerQueue, qpsDrop=arguments.triggerQpsDrop,
+                                  operationSeconds=arguments.triggerOperationSeconds, lag=arguments.triggerLag)
+
     with Console() as console:
-        queryScreen = QueryScreen(console, chosenServers, autoKillSeconds=arguments.autoKillSeconds)
+        queryScreen = QueryScreen(console, chosenServers, autoKillSeconds=arguments.autoKillSeconds,
+                                  samplingFrequency=arguments.samplingFrequency, topInterval=arguments.topInterval,
+                                  recorder=recorder)
         try:
             queryScreen.action()
         except KeyboardInterrupt: pass
+        finally:
+            if recorder:
+                recorder.close()
 
@@ -20,10 +20,15 @@ from __future__ import print_function
 
 """Library imports"""
 import json
+import time
+import numbers
 from bson import json_util
+from collections import deque
+from datetime import timedelta
 
 """Class imports"""
 from .console import Block
+from .server import ServerIndex, OplogTailer, OperationSampler
 
 class StatusBlock(Block):
     columnHeaders = ('Server', 'QPS', 'Active', 'Queue', 'Flush', 'Connection', 'Network I/O', 'Memory', 'Page Faults',)
@@ -33,37 +38,45 @@ class StatusBlock(Block):
         self.__servers = servers
         self.__oldStatus = {}
 
+    def __cells(self, server):
+        cells = []
+        cells.append(server)
+        status = server.status()
+        if status:
+            oldStatus = self.__oldStatus[server] if server in self.__oldStatus else status
+            sec = status.deepgetDiff(oldStatus, 'uptimeMillis') / 1000.0 if status is not oldStatus else 0
+            def rate(value):
+                """Do not show the rates calculated on zero length interval."""
+                return value / sec if sec else None
+
+            operations = sum(status.deepgetDiff(oldStatus, 'opcounters', k) for k in status.deepget('opcounters'))
+            connectionsCurrent = status.deepget('connections', 'current') or 0
+            connectionsAvailable = status.deepget('connections', 'available') or 0
+
+            cells.append(rate(operations))
+            cells.append(status.deepget('globalLock', 'activeClients', 'total'))
+            cells.append(status.deepget('globalLock', 'currentQueue', 'total'))
+            cells.append(rate(status.deepgetDiff(oldStatus, 'backgroundFlushing', 'flushes')))
+            cells.append([connectionsCurrent, connectionsCurrent + connectionsAvailable])
+            cells.append(status.deepget('network', ('bytesIn', 'bytesOut')))
+            cells.append([v * 10**6 for v in status.deepget('mem', ('resident', 'mapped')) if v is not None])
+            cells.append(rate(status.deepgetDiff(oldStatus, 'extra_info', 'page_faults')))
+
+            self.__oldStatus[server] = status
+        else:
+            cells.append(server.lastError())
+
+        return cells
+
     def reset(self):
+        """Add the lines for the shards after the mongos."""
         lines = []
 
         for server in self.__servers:
-            cells = []
-            cells.append(server)
-            status = server.status()
-            if status:
-                oldStatus = self.__oldStatus[server] if server in self.__oldStatus else status
-                sec = status.deepgetDiff(oldStatus, 'uptimeMillis') / 1000.0
-                if not sec:
-                    sec = 1
-
-                operations = sum(status.deepgetDiff(oldStatus, 'opcounters', k) for k in status.deepget('opcounters'))
-                connectionsCurrent = status.deepget('connections', 'current') or 0
-                connectionsAvailable = status.deepget('connections', 'available') or 0
-
-                cells.append(operations / sec)
-                cells.append(status.deepget('globalLock', 'activeClients', 'total'))
-                cells.append(status.deepget('globalLock', 'currentQueue', 'total'))
-                cells.append(status.deepgetDiff(oldStatus, 'backgroundFlushing', 'flushes') / sec)
-                cells.append([connectionsCurrent, connectionsCurrent + connectionsAvailable])
-                cells.append(status.deepget('network', ('bytesIn', 'bytesOut')))
-                cells.append([v * 10**6 for v in status.deepget('mem', ('resident', 'mapped')) if v is not None])
-                cells.append(status.deepgetDiff(oldStatus, 'extra_info', 'page_faults') / sec)
-
-                self.__oldStatus[server] = status
-            else:
-                cells.append(server.lastError())
-
-            lines.append(cells)
+            lines.append(self.__cells(server))
+            if server.connected() and server.isMongos():
+                for shardServer in server.shardServers():
+                    lines.append(self.__cells(shardServer))
 
         Block.reset(self, lines)
 
@@ -71,18 +84,70 @@ class ServerBasedBlock(Block):
     def __init__(self, servers):
         Block.__init__(self, self.columnHeaders)
         self.__servers = servers
-        self.__hiddenServers = []
+        self.__serverIndex = ServerIndex(servers)
+        self.__hiddenServers = set()
 
     def findServer(self, name):
-        for server in self.__servers:
-            if server.sameServer(name):
-                return server
+        if name:
+            return self.__serverIndex.find(name)
 
     def connectedServers(self):
         return [server for server in self.__servers if server.connected() and server not in self.__hiddenServers]
 
     def hideServer(self, server):
-        self.__hiddenServers.append(server)
+        self.__hiddenServers.add(server)
+
+class WiredTigerBlock(ServerBasedBlock):
+    columnHeaders = ('Server', 'Cache %', 'Dirty %', 'Evicted', 'App Evicted', 'Read Tickets', 'Write Tickets',
+                     'Checkpoint ms')
+
+    def __init__(self, servers):
+        ServerBasedBlock.__init__(self, servers)
+        self.__oldStatus = {}
+
+    def reset(self):
+        lines = []
+
+        for server in self.connectedServers():
+            cells = []
+            cells.append(server)
+            status = server.status()
+            if status and 'wiredTiger' in status:
+                oldStatus = self.__oldStatus[server] if server in self.__oldStatus else status
+                sec = status.deepgetDiff(oldStatus, 'uptimeMillis') / 1000.0 if status is not oldStatus else 0
+                def rate(value):
+                    """Do not show the rates calculated on zero length interval."""
+                    return value / sec if sec else None
+
+                cache = status.deepget('wiredTiger', 'cache') or {}
+                maximum = cache.get('maximum bytes configured')
+                evicted = sum(status.deepgetDiff(oldStatus, 'wiredTiger', 'cache', k)
+                              for k in ('unmodified pages evicted', 'modified pages evicted'))
+
+                if maximum:
+                    cells.append(100.0 * (cache.get('bytes currently in the cache') or 0) / maximum)
+                    cells.append(100.0 * (cache.get('tracked dirty bytes in the cache') or 0) / maximum)
+                else:
+                    cells += [None, None]
+                cells.append(rate(evicted))
+                cells.append(rate(status.deepgetDiff(oldStatus, 'wiredTiger', 'cache',
+                                                     'pages evicted by application threads')))
+                for operation in ('read', 'write'):
+                    cells.append(status.deepget('wiredTiger', 'concurrentTransactions', operation,
+                                                ('available', 'totalTickets')))
+                cells.append(status.deepget('wiredTiger', 'transaction',
+                                            'transaction checkpoint most recent time (msecs)'))
+
+                self.__oldStatus[server] = status
+            elif status:
+                self.hideServer(server)
+                continue
+            else:
+                cells.append(server.lastError())
+
+            lines.append(cells)
+
+        Block.reset(self, lines)
 
 class ReplicationInfoBlock(ServerBasedBlock):
     columnHeaders = ['Server', 'Source', 'SyncedTo', 'Inc']
@@ -144,6 +209,152 @@ class ReplicaSetMemberBlock(ServerBasedBlock):
 
         Block.reset(self, self.__lines)
 
+class SlidingWindow:
+    """Sums of values by keys for the last given seconds. Values are kept in buckets of one second to expire the old
+    ones without rescanning."""
+    def __init__(self, seconds):
+        self.__seconds = seconds
+        self.__startTime = time.time()
+        self.__buckets = deque()
+        self.__totals = {}
+
+    def __expire(self, now):
+        while self.__buckets and self.__buckets[0][0] <= now - self.__seconds:
+            second, bucket = self.__buckets.popleft()
+            for key, values in bucket.items():
+                totals = self.__totals[key]
+                for index, value in enumerate(values):
+                    totals[index] -= value
+                if not any(totals):
+                    del self.__totals[key]
+
+    def add(self, key, *values):
+        self.addAt(time.time(), key, *values)
+
+    def addAt(self, second, key, *values):
+        """Add the values to the bucket of the given time. Values older than the window are ignored, the ones older
+        than the last bucket are added to it."""
+        now = int(time.time())
+        second = int(second)
+        self.__expire(now)
+        if second <= now - self.__seconds:
+            return
+        if not self.__buckets or self.__buckets[-1][0] < second:
+            self.__buckets.append((second, {}))
+        bucket = self.__buckets[-1][1]
+
+        for sums in (bucket.setdefault(key, [0] * len(values)), self.__totals.setdefault(key, [0] * len(values))):
+            for index, value in enumerate(values):
+                sums[index] += value
+
+    def seconds(self):
+        """Return the seconds covered by the window which can be shorter than its length at the start."""
+        return max(1.0, min(self.__seconds, time.time() - self.__startTime))
+
+    def rates(self):
+        """Return the sums per second by keys."""
+        self.__expire(int(time.time()))
+        seconds = self.seconds()
+        return dict((key, [value / seconds for value in values]) for key, values in self.__totals.items())
+
+class OplogBlock(ServerBasedBlock):
+    columnHeaders = ('Server', 'Namespace', 'Type', 'OPS', 'Bytes/s')
+    windowSeconds = 10
+    types = {'i': 'insert', 'u': 'update', 'd': 'delete', 'c': 'command'}
+
+    def __init__(self, servers):
+        """Start an oplog tailer for every server."""
+        ServerBasedBlock.__init__(self, servers)
+        self.__tailers = {}
+        self.__windows = {}
+        for server in servers:
+            self.__tailers[server] = OplogTailer(server)
+            self.__tailers[server].start()
+
+    def reset(self):
+        """Take the entries tailed from the oplogs of the primaries since the last reset. Aggregate the operations and
+        the sizes of the entries by namespaces and types on the seconds of their timestamps."""
+        lines = []
+
+        for server in self.connectedServers():
+            tailer = self.__tailers[server]
+            if tailer.replicaSet() is False:
+                self.hideServer(server)
+                continue
+            entries = tailer.take()
+            if not tailer.primary():
+                self.__windows.pop(server, None)
+                continue
+
+            if server not in self.__windows:
+                self.__windows[server] = SlidingWindow(self.windowSeconds)
+            window = self.__windows[server]
+            for second, ns, op, size in entries:
+                if op in self.types:
+                    window.addAt(second, (ns, self.types[op]), 1, size)
+
+            for (ns, opType), (operations, size) in window.rates().items():
+                lines.append([server, ns, opType, operations, size])
+
+        def sortKey(line): return line[4]
+        lines.sort(key=sortKey, reverse=True)
+        Block.reset(self, lines)
+
+class TopBlock(ServerBasedBlock):
+    columnHeaders = ('Server', 'Namespace', 'Total', 'Read', 'Write', 'Queries', 'Getmore', 'Commands')
+    fields = ('total', 'readLock', 'writeLock', 'queries', 'getmore', 'commands')
+    limit = 10
+
+    def __init__(self, servers, interval):
+        ServerBasedBlock.__init__(self, servers)
+        self.__interval = interval
+        self.__baselines = {}
+        self.__serverLines = {}
+
+    def __sample(self, top):
+        """Flatten the times and the counts of the fields of the namespaces to tuples of numbers."""
+        sample = {}
+        for ns, usage in (top.get('totals') or {}).items():
+            if isinstance(usage, dict):
+                sample[ns] = tuple(usage.get(field, {}).get(k, 0) for field in self.fields for k in ('time', 'count'))
+        return sample
+
+    def reset(self):
+        """Execute top command on the servers when the interval passed. Calculate the milliseconds and the counts per
+        second of the fields for the namespaces. Show the ones spending the most time."""
+        lines = []
+        now = time.time()
+
+        for server in self.connectedServers():
+            baseline = self.__baselines.get(server)
+            if not baseline or now - baseline[0] >= self.__interval:
+                top = server.top()
+                if not top:
+                    self.hideServer(server)
+                    continue
+                sample = self.__sample(top)
+                self.__baselines[server] = now, sample
+
+                if baseline:
+                    sec = now - baseline[0]
+                    serverLines = []
+                    for ns, values in sample.items():
+                        if ns in baseline[1]:
+                            diffs = [value - oldValue for value, oldValue in zip(values, baseline[1][ns])]
+                            if diffs[0] > 0:
+                                cells = [server, ns]
+                                for index in range(0, len(diffs), 2):
+                                    cells.append([diffs[index] / 1000.0 / sec, diffs[index + 1] / sec])
+                                serverLines.append(cells)
+
+                    def sortKey(line): return line[2][0]
+                    serverLines.sort(key=sortKey, reverse=True)
+                    self.__serverLines[server] = serverLines[:self.limit]
+
+            lines.extend(self.__serverLines.get(server, ()))
+
+        Block.reset(self, lines)
+
 class Query:
     def __init__(self, **parts):
         """Translate query parts to arguments of pymongo find method."""
@@ -168,6 +379,21 @@ class Query:
     def __str__(self):
         return json.dumps(self.__parts, default=json_util.default)
 
+    @classmethod
+    def __shape(cls, value):
+        if isinstance(value, dict):
+            return '{' + ', '.join(key + ': ' + cls.__shape(value[key]) for key in sorted(value.keys())) + '}'
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            return '[' + ', '.join(cls.__shape(v) for v in value) + ']'
+        return '?'
+
+    def shape(self):
+        """Return the query with the values replaced by "?" to group the queries on the same fields."""
+        shape = self.__shape(self.__parts.get('spec'))
+        if 'sort' in self.__parts:
+            shape += ' sort: ' + ', '.join(str(pair[0]) for pair in self.__parts['sort'])
+        return shape
+
     def print(self):
         """Print formatted query parts."""
         for key, value in self.__parts.items():
@@ -204,65 +430,136 @@ class Query:
 
         return True
 
+class TrackedOperation:
+    """Lifecycle of an operation between the samples."""
+    def __init__(self, server, line, now):
+        self.server = server
+        self.line = line
+        self.firstSeen = now
+        self.lastSeen = now
+        self.peakSeconds = 0
+        self.peakLockWait = 0
+        self.failedSamples = 0
+
+    @classmethod
+    def lockWaitMicros(cls, lockStats):
+        """Sum the times acquiring the locks in any depth of the lock stats."""
+        total = 0
+        for key, value in lockStats.items():
+            if isinstance(value, dict):
+                if key == 'timeAcquiringMicros':
+                    total += sum(v for v in value.values() if isinstance(v, numbers.Number))
+                else:
+                    total += cls.lockWaitMicros(value)
+        return total
+
+    def update(self, op, now):
+        self.lastSeen = now
+        self.failedSamples = 0
+        self.peakSeconds = max(self.peakSeconds, op.get('secs_running') or 0, now - self.firstSeen)
+        if isinstance(op.get('lockStats'), dict):
+            self.peakLockWait = max(self.peakLockWait, self.lockWaitMicros(op['lockStats']))
+
 class OperationBlock(Block):
     columnHeaders = ('Server', 'Opid', 'Client', 'Type', 'Sec', 'Locks', 'Namespace', 'Query')
+    finishedLimit = 20
+    slowSeconds = 1
+    staleSamples = 5
 
     def __init__(self, servers, replicationOperationServers):
         Block.__init__(self, self.columnHeaders)
         self.__servers = servers
+        self.__serverIndex = ServerIndex(servers)
         self.__replicationOperationServers = replicationOperationServers
+        self.__operations = {}
+        self.__finishedOperations = deque(maxlen=self.finishedLimit)
+
+    @staticmethod
+    def __locks(op):
+        locks = []
+        if op.get('waitingForLock'):
+            locks.append('waiting')
+        if 'locks' in op:
+            if '^' in op['locks']:
+                """Do not show others if global lock exist."""
+                locks.append(op['locks']['^'])
+            else:
+                for ns, lock in op['locks'].items():
+                    locks.append(lock + ' on ' + ns[1:])
+        elif 'lockType' in op:
+            locks.append(op['lockType'])
+        return locks
+
+    def __line(self, server, op):
+        cells = []
+        cells.append(server)
+        cells.append(str(op.get('opid')))
+        cells.append(op.get('client'))
+        cells.append(op.get('op'))
+        cells.append(op.get('secs_running'))
+        cells.append(self.__locks(op))
+        cells.append(op.get('ns'))
+
+        if 'query' in op:
+            if '$msg' in op['query']:
+                cells.append(op['query']['$msg'])
+            else:
+                cells.append(Query(**op['query']))
+
+        return cells
 
     def reset(self):
-        self.__lines = []
+        """Diff the operations with the previous sample by servers and opids. Update the lines of the existent ones in
+        place, add the new ones. Move the slow ones which are not in the sample anymore to the finished operations."""
+        now = time.time()
+        seenKeys = set()
+        sampledServers = set()
 
         for server in self.__servers:
-            if server.connected():
-                hideReplicationOperations = server not in self.__replicationOperationServers
-                for op in server.currentOperations(hideReplicationOperations):
-                    cells = []
-                    cells.append(server)
-                    cells.append(str(op.get('opid')))
-                    cells.append(op.get('client'))
-                    cells.append(op.get('op'))
-                    cells.append(op.get('secs_running'))
-
-                    locks = []
-                    if op.get('waitingForLock'):
-                        locks.append('waiting')
-                    if 'locks' in op:
-                        if '^' in op['locks']:
-                            """Do not show others if global lock exist."""
-                            locks.append(op['locks']['^'])
-                        else:
-                            for ns, lock in op['locks'].items():
-                                locks.append(lock + ' on ' + ns[1:])
-                    elif 'lockType' in op:
-                        locks.append(op['lockType'])
-
-                    cells.append(locks)
-                    cells.append(op.get('ns'))
-
-                    if 'query' in op:
-                        if '$msg' in op['query']:
-                            cells.append(op['query']['$msg'])
-                        else:
-                            cells.append(Query(**op['query']))
-
-                    self.__lines.append(cells)
+            hideReplicationOperations = server not in self.__replicationOperationServers
+            operations = server.currentOperations(hideReplicationOperations)
+            if operations is not None:
+                sampledServers.add(server)
+                for op in operations:
+                    """Show the operations of the cluster with the shards they are running on."""
+                    lineServer = op.get('shard') and server.isMongos() and server.shardServer(op['shard']) or server
+                    key = (str(lineServer), str(op.get('opid')))
+                    seenKeys.add(key)
+                    if key in self.__operations:
+                        operation = self.__operations[key]
+                        operation.line[4] = op.get('secs_running')
+                        operation.line[5] = self.__locks(op)
+                    else:
+                        operation = TrackedOperation(server, self.__line(lineServer, op), now)
+                        self.__operations[key] = operation
+                    operation.update(op, now)
+
+        for key in [key for key in self.__operations if key not in seenKeys]:
+            operation = self.__operations[key]
+            if operation.server in sampledServers:
+                del self.__operations[key]
+                if operation.peakSeconds >= self.slowSeconds:
+                    self.__finishedOperations.appendleft(operation)
+            else:
+                """Keep the operations of the servers which could not be sampled for their next samples, but do not
+                show, kill or record them."""
+                operation.failedSamples += 1
+                if operation.failedSamples > self.staleSamples:
+                    del self.__operations[key]
 
+        self.__lines = [operation.line for operation in self.__operations.values() if not operation.failedSamples]
         def sortKey(line): return line[4] or -1
         self.__lines.sort(key=sortKey, reverse=True)
         Block.reset(self, self.__lines)
 
-    def __findServer(self, serverName):
-        for server in self.__servers:
-            if str(server) == serverName:
-                return server
+    def finishedOperations(self):
+        return self.__finishedOperations
 
     def __findLine(self, serverName, opid):
-        for line in self.__lines:
-            if str(line[0]) == serverName and str(line[1]) == opid:
-                return line
+        server = self.__serverIndex.find(serverName)
+        operation = self.__operations.get((str(server) if server else serverName, opid))
+        if operation:
+            return operation.line
 
     def explainQuery(self, *parameters):
         line = self.__findLine(*parameters)
@@ -272,8 +569,10 @@ class OperationBlock(Block):
             return query.printExplain(line[0], line[6])
 
     def kill(self, serverName, opid):
-        server = self.__findServer(serverName)
-        return server.killOperation(opid)
+        line = self.__findLine(serverName, opid)
+        server = line[0] if line else self.__serverIndex.find(serverName)
+        if server:
+            return server.killOperation(opid)
 
     def batchKill(self, second):
         """Kill operations running more than given seconds from top to bottom."""
@@ -285,19 +584,127 @@ class OperationBlock(Block):
             server = line[0]
             server.killOperation(line[1])
 
+class FinishedOperationBlock(Block):
+    columnHeaders = ('Server', 'Opid', 'Type', 'Sec', 'Lock Wait', 'Namespace', 'Started', 'Finished', 'Query')
+    timeFormat = '%H:%M:%S'
+
+    def __init__(self, operationBlock):
+        Block.__init__(self, self.columnHeaders)
+        self.__operationBlock = operationBlock
+
+    def reset(self):
+        lines = []
+
+        for operation in self.__operationBlock.finishedOperations():
+            cells = []
+            cells.append(operation.line[0])
+            cells.append(operation.line[1])
+            cells.append(operation.line[3])
+            cells.append(operation.peakSeconds)
+            cells.append(timedelta(microseconds=operation.peakLockWait) if operation.peakLockWait else None)
+            cells.append(operation.line[6])
+            cells.append(time.strftime(self.timeFormat, time.localtime(operation.firstSeen)))
+            cells.append(time.strftime(self.timeFormat, time.localtime(operation.lastSeen)))
+            if len(operation.line) > 7:
+                cells.append(operation.line[7])
+
+            lines.append(cells)
+
+        Block.reset(self, lines)
+
+class SamplingBlock(Block):
+    columnHeaders = ('Server', 'Samples/s', 'Overhead %', 'Namespace', 'Type', 'Share %', 'Shape')
+    windowSeconds = 10
+
+    def __init__(self, servers, replicationOperationServers, frequency):
+        """Start a sampler for every server."""
+        Block.__init__(self, self.columnHeaders)
+        self.__samplers = []
+        self.__windows = {}
+        for server in servers:
+            hideReplicationOperations = server not in replicationOperationServers
+            sampler = OperationSampler(server, frequency, self.sampleKey, hideReplicationOperations)
+            sampler.start()
+            self.__samplers.append((server, sampler))
+            self.__windows[server] = SlidingWindow(self.windowSeconds)
+
+    @staticmethod
+    def sampleKey(op):
+        query = op.get('query') or (op.get('command') or {}).get('filter') or (op.get('command') or {}).get('q')
+        if isinstance(query, dict) and '$msg' not in query:
+            try:
+                query = Query(**query).shape()
+            except TypeError:
+                query = None
+        else:
+            query = None
+        return op.get('ns'), op.get('op'), query
+
+    def reset(self):
+        """Take the samples collected since the last reset. Estimate the share of the time of the keys by the ratio of
+        the samples they appeared to all samples like a statistical profiler."""
+        lines = []
+
+        for server, sampler in self.__samplers:
+            window = self.__windows[server]
+            samples, busySeconds = sampler.take()
+            window.add(None, len(samples), busySeconds)
+            for keys in samples:
+                for key in set(keys):
+                    window.add(key, 1)
+
+            rates = window.rates()
+            sampleRate, busyRate = rates.pop(None, (0, 0))
+            if sampleRate:
+                for (ns, opType, shape), (rate,) in rates.items():
+                    lines.append([server, sampleRate, busyRate * 100, ns, opType, rate / sampleRate * 100, shape])
+
+        def sortKey(line): return line[5]
+        lines.sort(key=sortKey, reverse=True)
+        Block.reset(self, lines)
+
+class RecorderBlock(Block):
+    columnHeaders = ('Records', 'Memory', 'Last Dump', 'Dump Error')
+
+    def __init__(self, recorder):
+        Block.__init__(self, self.columnHeaders)
+        self.__recorder = recorder
+
+    def reset(self):
+        recorder = self.__recorder
+        Block.reset(self, [[recorder.records(), recorder.size(), recorder.lastDumpPath(), recorder.lastError()]])
+
 class QueryScreen:
-    def __init__(self, console, chosenServers, autoKillSeconds=None):
+    def __init__(self, console, chosenServers, autoKillSeconds=None, samplingFrequency=None, topInterval=5,
+                 recorder=None):
         self.__console = console
         self.__servers = set(server for servers in chosenServers.values() for server in servers)
 
         self.__blocks = []
-        self.__blocks.append(StatusBlock(chosenServers['status']))
+        self.__statusBlock = StatusBlock(chosenServers['status'])
+        self.__blocks.append(self.__statusBlock)
+        if recorder:
+            self.__blocks.append(RecorderBlock(recorder))
+        self.__blocks.append(WiredTigerBlock(chosenServers['wiredTiger']))
         self.__blocks.append(ReplicationInfoBlock(chosenServers['replicationInfo']))
-        self.__blocks.append(ReplicaSetMemberBlock(chosenServers['replicaSet']))
+        self.__replicaSetMemberBlock = ReplicaSetMemberBlock(chosenServers['replicaSet'])
+        self.__blocks.append(self.__replicaSetMemberBlock)
+        self.__blocks.append(OplogBlock(chosenServers['oplog']))
+        self.__blocks.append(TopBlock(chosenServers['top'], topInterval))
         self.__operationBlock = OperationBlock(chosenServers['operations'], chosenServers['replicationOperations'])
+        if samplingFrequency:
+            self.__blocks.append(SamplingBlock(chosenServers['operations'], chosenServers['replicationOperations'],
+                                               samplingFrequency))
+        finishedOperationBlock = FinishedOperationBlock(self.__operationBlock)
+        self.__blocks.append(finishedOperationBlock)
         self.__blocks.append(self.__operationBlock)
+        """Finished operations are shown before the operations not to be left without lines, but they are found
+        while the operation block is reset."""
+        self.__resettingBlocks = [block for block in self.__blocks if block is not finishedOperationBlock]
+        self.__resettingBlocks.append(finishedOperationBlock)
 
         self.__autoKillSeconds = autoKillSeconds
+        self.__recorder = recorder
 
     def action(self):
         """Reset the blocks, refresh the console, perform actions for the pressed button."""
@@ -305,8 +712,13 @@ class QueryScreen:
         counter = 0
 
         while button != 'q':
-            for block in self.__blocks:
+            for server in self.__servers:
+                server.forgetStatus()
+            for block in self.__resettingBlocks:
                 block.reset()
+            if self.__recorder:
+                self.__recorder.record(self.__statusBlock.lines(), self.__operationBlock.lines(),
+                                       self.__replicaSetMemberBlock.lines())
             self.__console.refresh(self.__blocks)
             button = self.__console.checkButton(1)
             counter += 1
@@ -340,5 +752,11 @@ class QueryScreen:
             if button in ('r', 'R') or counter % 20 == 0:
                 for server in self.__servers:
                     if button == 'R' or not server.connected():
+                        """Shards of the mongos are discovered again after it is connected."""
                         server.tryToConnect()
+                    elif server.isMongos():
+                        server.discoverShards()
+                        for shardServer in server.shardServers():
+                            if not shardServer.connected():
+                                shardServer.tryToConnect()
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+# motop - Unix "top" Clone for MongoDB
+#
+# Copyright (c) 2012, Tart İnternet Teknolojileri Ticaret AŞ
+#
+# Permission to use, copy, modify, and/or distribute this software for any purpose with or without fee is hereby
+# granted, provided that the above copyright notice and this permission notice appear in all copies.
+#
+# The software is provided "as is" and the author disclaims all warranties with regard to the software including all
+# implied warranties of merchantability and fitness. In no event shall the author be liable for any special, direct,
+# indirect, or consequential damages or any damages whatsoever resulting from loss of use, data or profits, whether
+# in an action of contract, negligence or other tortious action, arising out of or in connection with the use or
+# performance of this software.
+##
+
+"""Library imports"""
+import os
+import gzip
+import json
+import numbers
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+class FlightRecorder:
+    """Keep the trimmed lines of the status, operation and replica set blocks of the last minutes in memory. Dump them
+    to a compressed file on a background thread when one of the triggers fire."""
+    queryLength = 200
+    qpsSmoothing = 0.1
+    cooldownSeconds = 60
+    fileNameFormat = 'motop-%Y%m%d-%H%M%S.json.gz'
+
+    def __init__(self, directory, minutes=10, megabytes=50, queue=None, qpsDrop=None, operationSeconds=None,
+                 lag=None):
+        self.__directory = directory
+        self.__seconds = minutes * 60
+        self.__maximumSize = megabytes * 2**20
+        self.__queue = queue
+        self.__qpsDrop = qpsDrop
+        self.__operationSeconds = operationSeconds
+        self.__lag = lag
+        self.__records = deque()
+        self.__size = 0
+        self.__averageQps = {}
+        self.__lastDumpTime = None
+        self.__dumpThread = None
+        self.__lastDumpPath = None
+        self.__lastError = None
+
+    def __trim(self, value):
+        """Convert the cell to a JSON serializable value."""
+        if isinstance(value, list):
+            return [self.__trim(v) for v in value]
+        if isinstance(value, timedelta):
+            return value.days * 86400 + value.seconds + value.microseconds / 1000000.0
+        if value is None or isinstance(value, numbers.Number):
+            return value
+        return str(value)[:self.queryLength]
+
+    def __append(self, now, record):
+        """Append the record as a JSON string. Drop the old ones which are out of the minutes or the size."""
+        self.__records.append((now, record))
+        self.__size += len(record)
+        while self.__records and (self.__size > self.__maximumSize or self.__records[0][0] < now - self.__seconds):
+            self.__size -= len(self.__records.popleft()[1])
+
+    def __triggers(self, statusLines, operationLines, replicaSetLines):
+        """Yield the reasons for the fired triggers."""
+        for line in statusLines:
+            if len(line) > 3:
+                server, qps, queue = str(line[0]), line[1], line[3]
+                if self.__queue is not None and queue is not None and queue > self.__queue:
+                    yield 'queue of {0} is {1}'.format(server, queue)
+                if self.__qpsDrop is not None and isinstance(qps, numbers.Number) and \
+                        (qps or server in self.__averageQps):
+                    """Skip missing QPS of the first refresh and zero length intervals, and zero QPS before the
+                    average is seeded."""
+                    averageQps = self.__averageQps.get(server, qps)
+                    if averageQps and qps < averageQps * (1 - self.__qpsDrop / 100.0):
+                        yield 'qps of {0} dropped to {1} from {2}'.format(server, int(qps), int(averageQps))
+                    self.__averageQps[server] = averageQps + (qps - averageQps) * self.qpsSmoothing
+
+        if self.__operationSeconds is not None:
+            for line in operationLines:
+                if line[4] is not None and line[4] > self.__operationSeconds:
+                    yield 'operation {0} on {1} is running for {2} seconds'.format(line[1], line[0], line[4])
+
+        if self.__lag is not None:
+            for line in replicaSetLines:
+                lag = self.__trim(line[5])
+                if lag is not None and lag > self.__lag:
+                    yield 'lag of {0} is {1} seconds'.format(line[0], lag)
+
+    def record(self, statusLines, operationLines, replicaSetLines):
+        """Record the lines of the blocks. Start dumping if a trigger fires and the last dump is not recent."""
+        now = time.time()
+        record = {'time': now,
+                  'status': self.__trim(statusLines),
+                  'operations': self.__trim(operationLines),
+                  'replicaSet': self.__trim(replicaSetLines)}
+        self.__append(now, json.dumps(record))
+
+        reasons = list(self.__triggers(statusLines, operationLines, replicaSetLines))
+        if reasons and (self.__lastDumpTime is None or now - self.__lastDumpTime > self.cooldownSeconds):
+            if self.__dumpThread is None or not self.__dumpThread.is_alive():
+                self.__lastDumpTime = now
+                records = [record for recordTime, record in self.__records]
+                self.__dumpThread = threading.Thread(target=self.__dump, args=(now, reasons, records))
+                self.__dumpThread.daemon = True
+                self.__dumpThread.start()
+
+    def __dump(self, now, reasons, records):
+        """Write the reasons and the records to the compressed file as JSON lines."""
+        path = os.path.join(self.__directory, time.strftime(self.fileNameFormat, time.localtime(now)))
+        try:
+            dumpFile = gzip.open(path, 'wb')
+            try:
+                dumpFile.write((json.dumps({'time': now, 'reasons': reasons}) + '\n').encode('utf-8'))
+                for record in records:
+                    dumpFile.write((record + '\n').encode('utf-8'))
+            finally:
+                dumpFile.close()
+            self.__lastDumpPath = path
+        except (IOError, OSError) as error:
+            self.__lastError = error
+
+    def close(self, timeout=10):
+        """Wait for the dump in progress not to leave a truncated file."""
+        if self.__dumpThread is not None:
+            self.__dumpThread.join(timeout)
+
+    def records(self):
+        return len(self.__records)
+
+    def size(self):
+        return self.__size
+
+    def lastDumpPath(self):
+        return self.__lastDumpPath
+
+    def lastError(self):
+        return self.__lastError
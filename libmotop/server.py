@@ -19,21 +19,52 @@
 import os
 import sys
 import time
+import calendar
+import threading
+import bson
 import pymongo
 
+"""Raw documents are used to get the sizes of the oplog entries without encoding them again."""
+try:
+    from bson.raw_bson import RawBSONDocument
+    from bson.codec_options import CodecOptions
+except ImportError:
+    RawBSONDocument = None
+
 class Server:
     def __init__(self, name, address, username=None, password=None):
         self.__name = name
         self.__address = address
         self.__username = username
         self.__password = password
+        self.__oplogTimestamp = None
+        self.__aggregateCurrentOp = hasattr(pymongo.database.Database, 'aggregate')
+        self.__aggregateSampling = self.__aggregateCurrentOp
+        self.__connection = None
+        self.__shardServers = None
+        self.__status = None
+        self.__statusFetched = False
         self.tryToConnect()
 
     connectionClass = pymongo.MongoClient if pymongo.version_tuple >= (2, 4) else pymongo.Connection
     connectionParemeters = {'connectTimeoutMS': 1000, 'read_preference': pymongo.ReadPreference.SECONDARY}
+    if hasattr(pymongo, 'CursorType'):
+        oplogCursorParameters = {'cursor_type': pymongo.CursorType.TAILABLE_AWAIT, 'oplog_replay': True}
+    else:
+        oplogCursorParameters = {'tailable': True, 'await_data': True}
+    oplogAwaitMilliseconds = 100
+    clusterOperationsPipeline = [{'$currentOp': {'allUsers': True, 'localOps': False}}, {'$match': {'active': True}}]
+    """Error codes for the unrecognized pipeline stage on 3.4 and 3.2, the invalid namespace of the aggregation
+    without collection before 3.6, and the command not found"""
+    unsupportedAggregationCodes = (40324, 16436, 73, 59)
+    samplingPipeline = [{'$currentOp': {'allUsers': True}},
+                        {'$match': {'active': True, 'command.pipeline.$currentOp': {'$exists': False}}},
+                        {'$project': {'op': 1, 'ns': 1, 'query': 1, 'command.filter': 1, 'command.q': 1}}]
 
     def tryToConnect(self):
-        self.__connection = None
+        self.close()
+        self.__oplogCursor = None
+        self.__mongos = None
         try:
             self.__connection = self.connectionClass(self.__address, **self.connectionParemeters)
         except pymongo.errors.ConnectionFailure as error:
@@ -42,17 +73,30 @@ class Server:
         if self.__username and self.__password:
             self.__connection.admin.authenticate(self.__username, self.__password)
 
+    def close(self):
+        """Close the connection and the connections of the shards discovered through it."""
+        if self.__connection is not None:
+            self.__connection.close()
+        self.__connection = None
+        for shardServer in self.__shardServers or ():
+            shardServer.close()
+        self.__shardServers = None
+        self.__shardDiscoveryTried = False
+
     def __str__(self):
         return self.__name
 
-    def sameServer(self, name):
-        if self.__name == name:
-            return True
-        if self.__address == name:
-            return True
-        if ':' not in self.__address and self.__address + ':' + str(self.connectionClass.PORT) == name:
-            return True
-        return False
+    @classmethod
+    def normalizeAddress(cls, address):
+        """Return the address as lower case host:port."""
+        address = address.lower()
+        if ':' not in address:
+            address += ':' + str(cls.connectionClass.PORT)
+        return address
+
+    def addresses(self):
+        """Return the names the server can be found by."""
+        return self.__name, self.__address, self.normalizeAddress(self.__address)
 
     def connected(self):
         return self.__connection is not None
@@ -81,8 +125,26 @@ class Server:
         return self.__lastError
 
     def status(self):
+        """Execute serverStatus operation on the server. Reuse the result until it is forgotten for the blocks
+        refreshed at the same time."""
         if self.connected():
-            result = self.__execute(self.__connection.admin.command, 'serverStatus')
+            if not self.__statusFetched:
+                result = self.__execute(self.__connection.admin.command, 'serverStatus')
+                self.__status = Result(result) if result else None
+                self.__statusFetched = True
+
+            return self.__status
+
+    def forgetStatus(self):
+        """Forget the status of the server and its shards to execute serverStatus again on the next refresh."""
+        self.__status = None
+        self.__statusFetched = False
+        for shardServer in self.__shardServers or ():
+            shardServer.forgetStatus()
+
+    def top(self):
+        if self.connected():
+            result = self.__execute(self.__connection.admin.command, 'top')
 
             if result:
                 return Result(result)
@@ -92,6 +154,64 @@ class Server:
         for source in self.__executeYield(self.__connection.local.sources.find):
             return Result(source)
 
+    def isMaster(self):
+        if self.connected():
+            result = self.__execute(self.__connection.admin.command, 'isMaster')
+
+            if result:
+                return Result(result)
+
+    def isMongos(self):
+        """Check the server is a mongos once for every connection."""
+        if self.__mongos is None:
+            isMaster = self.isMaster()
+            if isMaster:
+                self.__mongos = isMaster.get('msg') == 'isdbgrid'
+        return bool(self.__mongos)
+
+    def discoverShards(self):
+        """Discover the shards of the cluster from the config database of the mongos. Keep the servers of the known
+        shards, connect to the primaries of the new ones with the same credentials, close the removed ones. Keep the
+        last discovered ones, if the config database cannot be read."""
+        self.__shardDiscoveryTried = True
+        if not self.connected() or not self.isMongos():
+            return
+        try:
+            shards = list(self.__connection.config.shards.find(sort=[('_id', 1)]))
+        except (pymongo.errors.AutoReconnect, pymongo.errors.OperationFailure) as error:
+            self.__lastError = error
+            return
+
+        knownServers = dict((shardServer.shardName(), shardServer) for shardServer in self.__shardServers or ())
+        shardServers = []
+        for shard in shards:
+            if shard['_id'] in knownServers:
+                shardServers.append(knownServers.pop(shard['_id']))
+                continue
+            if '/' in shard['host']:
+                replicaSet, hosts = shard['host'].split('/', 1)
+                address = 'mongodb://' + hosts + '/?replicaSet=' + replicaSet
+            else:
+                address = shard['host']
+            name = self.__name + '/' + shard['_id']
+            shardServers.append(ShardServer(name, address, self.__username, self.__password, self, shard['_id']))
+        for shardServer in knownServers.values():
+            shardServer.close()
+        self.__shardServers = shardServers
+
+    def shardServers(self):
+        """Return the servers of the shards. Discover them once for every connection, they are discovered again on
+        the reconnect actions."""
+        if not self.__shardDiscoveryTried:
+            self.discoverShards()
+        return self.__shardServers or []
+
+    def shardServer(self, shardName):
+        """Find the server of the shard by its name on the cluster."""
+        for shardServer in self.shardServers():
+            if shardServer.shardName() == shardName:
+                return shardServer
+
     def replicaSetMembers(self):
         """Execute replSetGetStatus operation on the server. Filter arbiters. Calculate the lag. Add relation to the
         member which is the server itself. Return the replica set."""
@@ -104,20 +224,109 @@ class Server:
 
                     yield Result(member)
 
+    def __filterOperations(self, operations, hideReplicationOperations):
+        for op in operations:
+            if hideReplicationOperations:
+                if op.get('op') == 'getmore' and op.get('ns').startswith('local.oplog.'):
+                    """Condition to find replication operation on the master."""
+                    continue
+                if op.get('op') and op.get('ns') in ('', 'local.sources'):
+                    """Condition to find replication operation on the slave."""
+                    continue
+
+            yield Result(op)
+
     def currentOperations(self, hideReplicationOperations=False):
-        """Execute currentOp operation on the server. Filter and yield returning operations."""
+        """Execute currentOp operation on the server. Filter and return the operations, None if they cannot be got.
+        Get the operations of all of the shards with the $currentOp aggregation stage in one round trip, if the server
+        is a mongos."""
+        if not self.connected():
+            return None
+
+        if self.__aggregateCurrentOp and self.isMongos():
+            try:
+                operations = list(self.__connection.admin.aggregate(self.clusterOperationsPipeline))
+            except pymongo.errors.OperationFailure as error:
+                self.__lastError = error
+                if getattr(error, 'code', None) in self.unsupportedAggregationCodes:
+                    """Do not try again, if the mongos does not support the $currentOp aggregation stage."""
+                    self.__aggregateCurrentOp = False
+            except pymongo.errors.AutoReconnect as error:
+                self.__lastError = error
+                return None
+            else:
+                return list(self.__filterOperations(operations, hideReplicationOperations))
+
         operations = self.__execute(self.__connection.admin.current_op)
-        if operations:
-            for op in operations['inprog']:
-                if hideReplicationOperations:
-                    if op.get('op') == 'getmore' and op.get('ns').startswith('local.oplog.'):
-                        """Condition to find replication operation on the master."""
-                        continue
-                    if op.get('op') and op.get('ns') in ('', 'local.sources'):
-                        """Condition to find replication operation on the slave."""
-                        continue
-
-                yield Result(op)
+        if operations and 'inprog' in operations:
+            return list(self.__filterOperations(operations['inprog'], hideReplicationOperations))
+
+    def sampleOperations(self, hideReplicationOperations=False):
+        """Get the active operations with only the fields needed for sampling. Use the $currentOp aggregation stage to
+        project them on the server, fall back to the currentOp command filtered with the active flag. Return None if
+        they cannot be got."""
+        if self.__aggregateSampling:
+            try:
+                operations = list(self.__connection.admin.aggregate(self.samplingPipeline))
+            except pymongo.errors.OperationFailure as error:
+                self.__lastError = error
+                if getattr(error, 'code', None) not in self.unsupportedAggregationCodes:
+                    return None
+                """Do not try again, if the server does not support the $currentOp aggregation stage."""
+                self.__aggregateSampling = False
+            except pymongo.errors.AutoReconnect as error:
+                self.__lastError = error
+                return None
+            else:
+                return list(self.__filterOperations(operations, hideReplicationOperations))
+
+        operations = self.__execute(self.__connection.admin.command, 'currentOp', active=True)
+        if operations and 'inprog' in operations:
+            return [op for op in self.__filterOperations(operations['inprog'], hideReplicationOperations)
+                    if 'currentOp' not in (op.get('query') or {})]
+
+    def oplogEntries(self, timeout):
+        """Tail the oplog with a tailable await cursor. Start after the last entry on the first call, resume after
+        the last seen timestamp if the cursor is dead. Yield the entries with their sizes until the timeout as seconds
+        passes."""
+        if RawBSONDocument:
+            oplog = self.__connection.local.get_collection('oplog.rs',
+                                                           codec_options=CodecOptions(document_class=RawBSONDocument))
+        else:
+            oplog = self.__connection.local.oplog.rs
+        if self.__oplogTimestamp is None:
+            for entry in self.__executeYield(oplog.find, sort=[('$natural', -1)], limit=1):
+                self.__oplogTimestamp = entry['ts']
+            if self.__oplogTimestamp is None:
+                return
+
+        if self.__oplogCursor is None or not self.__oplogCursor.alive:
+            self.__oplogCursor = self.__execute(oplog.find, {'ts': {'$gt': self.__oplogTimestamp}},
+                    **self.oplogCursorParameters)
+            if self.__oplogCursor is None:
+                return
+            if hasattr(self.__oplogCursor, 'max_await_time_ms'):
+                self.__oplogCursor.max_await_time_ms(self.oplogAwaitMilliseconds)
+
+        deadline = time.time() + timeout
+        try:
+            while self.__oplogCursor.alive and time.time() < deadline:
+                """Iteration stops when no more entries are ready, but the tailable cursor stays alive."""
+                for entry in self.__oplogCursor:
+                    self.__oplogTimestamp = entry['ts']
+                    yield entry, len(entry.raw) if RawBSONDocument else len(bson.BSON.encode(entry))
+                    if time.time() > deadline:
+                        break
+        except (pymongo.errors.AutoReconnect, pymongo.errors.OperationFailure) as error:
+            self.__lastError = error
+            self.__oplogCursor = None
+
+    def stopTailingOplog(self):
+        """Forget the cursor and the last seen timestamp to start from the end of the oplog next time."""
+        if self.__oplogCursor is not None:
+            self.__oplogCursor.close()
+        self.__oplogCursor = None
+        self.__oplogTimestamp = None
 
     def explainQuery(self, namespace, findParameters):
         databaseName, collectionName = namespace.split('.', 1)
@@ -128,6 +337,9 @@ class Server:
     def killOperation(self, opid):
         """Kill operation using the "mongo" executable on the shell. That is because I could not make it with
         pymongo."""
+        if not str(opid).isdigit():
+            """Operations on the shards are identified by strings on the mongos."""
+            opid = '"' + str(opid) + '"'
         command = "echo 'db.killOp({0})' | mongo".format(str(opid))
         command += ' ' + self.__address + '/admin'
         if self.__username:
@@ -138,6 +350,142 @@ class Server:
         exitCode = os.system(command)
         return exitCode == 0
 
+class ShardServer(Server):
+    """Server for the primary of a shard discovered through a mongos."""
+    connectionParemeters = dict(Server.connectionParemeters, read_preference=pymongo.ReadPreference.PRIMARY)
+
+    def __init__(self, name, address, username, password, mongos, shardName):
+        self.__mongos = mongos
+        self.__shardName = shardName
+        Server.__init__(self, name, address, username, password)
+
+    def shardName(self):
+        return self.__shardName
+
+    def killOperation(self, opid):
+        """Kill the operation through the mongos as the opids of the cluster operations are prefixed with the shard
+        names."""
+        return self.__mongos.killOperation(opid)
+
+class ServerIndex:
+    """Index of the servers by their names and normalized addresses to find them without looping."""
+    def __init__(self, servers=()):
+        self.__servers = {}
+        for server in servers:
+            self.add(server)
+
+    def add(self, server):
+        for address in server.addresses():
+            self.__servers.setdefault(address, server)
+
+    def find(self, name):
+        if name in self.__servers:
+            return self.__servers[name]
+        return self.__servers.get(Server.normalizeAddress(name))
+
+class OplogTailer(threading.Thread):
+    """Thread to tail the oplog of the server while it is the primary of a replica set. Timestamps converted to the
+    local clock, namespaces, types and sizes of the entries are kept until they are taken."""
+    tailSeconds = 1
+    waitSeconds = 1
+
+    def __init__(self, server):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__server = server
+        self.__lock = threading.Lock()
+        self.__entries = []
+        self.__replicaSet = None
+        self.__primary = False
+
+    def __tail(self):
+        isMaster = self.__server.isMaster() if self.__server.connected() else None
+        if not isMaster:
+            return
+        self.__replicaSet = bool(isMaster.get('setName'))
+        self.__primary = self.__replicaSet and bool(isMaster.get('ismaster'))
+        if not self.__primary:
+            """Start from the end of the oplog when the server become the primary again."""
+            self.__server.stopTailingOplog()
+            return
+
+        clockOffset = 0
+        if isMaster.get('localTime'):
+            clockOffset = calendar.timegm(isMaster['localTime'].utctimetuple()) - time.time()
+        entries = []
+        for entry, size in self.__server.oplogEntries(self.tailSeconds):
+            entries.append((entry['ts'].time - clockOffset, entry.get('ns'), entry.get('op'), size))
+        with self.__lock:
+            self.__entries.extend(entries)
+
+    def run(self):
+        """Stop when the server is known not to be a member of a replica set like a mongos or a standalone server."""
+        while self.__replicaSet is not False:
+            startTime = time.time()
+            try:
+                self.__tail()
+            except Exception:
+                """Keep the thread alive on unexpected failures like disconnection while tailing."""
+                pass
+            time.sleep(max(0, self.waitSeconds - (time.time() - startTime)))
+
+    def replicaSet(self):
+        """Return None until the server is reached, then whether it is a member of a replica set."""
+        return self.__replicaSet
+
+    def primary(self):
+        return self.__primary
+
+    def take(self):
+        with self.__lock:
+            entries, self.__entries = self.__entries, []
+        return entries
+
+class OperationSampler(threading.Thread):
+    """Thread to sample the active operations of the server with the given frequency. Keys of the sampled operations
+    are kept until they are taken."""
+    maximumFrequency = 50
+
+    def __init__(self, server, frequency, key, hideReplicationOperations=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__server = server
+        assert frequency > 0
+        self.__interval = 1.0 / min(frequency, self.maximumFrequency)
+        self.__key = key
+        self.__hideReplicationOperations = hideReplicationOperations
+        self.__lock = threading.Lock()
+        self.__samples = []
+        self.__busySeconds = 0
+
+    def __sample(self, startTime):
+        if self.__server.connected():
+            operations = self.__server.sampleOperations(self.__hideReplicationOperations)
+            keys = [self.__key(op) for op in operations] if operations is not None else None
+            busySeconds = time.time() - startTime
+            with self.__lock:
+                """Failed polls are not samples, but the time waiting for them is the overhead."""
+                if keys is not None:
+                    self.__samples.append(keys)
+                self.__busySeconds += busySeconds
+
+    def run(self):
+        while True:
+            startTime = time.time()
+            try:
+                self.__sample(startTime)
+            except Exception:
+                """Keep the thread alive on unexpected failures like disconnection while sampling."""
+                pass
+            time.sleep(max(0, self.__interval - (time.time() - startTime)))
+
+    def take(self):
+        """Return the samples and the seconds spent waiting for the server since the last call."""
+        with self.__lock:
+            samples, busySeconds = self.__samples, self.__busySeconds
+            self.__samples, self.__busySeconds = [], 0
+        return samples, busySeconds
+
 class Result(dict):
     def deepget(self, arg, *args):
         if isinstance(arg, tuple):